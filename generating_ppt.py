@@ -1,84 +1,145 @@
 import streamlit as st
 import json
-import ollama
-from PyPDF2 import PdfReader
 from pptx import Presentation
-from pptx.util import Pt, Inches
+from pptx.util import Inches
 from pptx.dml.color import RGBColor
+from pptx.oxml import parse_xml
+from pptx.oxml.ns import nsdecls, qn
+import concurrent.futures
 import io
-import re
-
-@st.cache_data
-def fetch_ppt_content(text_content, slide_count):
-    RESPONSE_JSON = {
-        "slides": [
-            {
-                "title": "Clear Slide Title 1",
-                "content": ["Concise point 1", "Relevant point 2", "Key takeaway 3"]
-            }
-        ]
-    }
+from xml.sax.saxutils import escape
+from llm import (
+    CACHE_TTL, LLM_BACKEND, MAX_TEXT_CHARS, MODEL, NUM_CTX, cache_key, chat, extract_json,
+    get_llm_cache, get_llm_client, get_llm_semaphore, read_pdf_pages,
+    select_model, select_text, split_text, submit, warm_prompt_cache,
+)
 
-    PROMPT_TEMPLATE = f"""
-    Text: {text_content}
-    Create a structured PowerPoint presentation with exactly {slide_count} slides.
-    Follow these rules:
-    1. Slide titles should be 3-7 words
-    2. Each slide should have 3-5 bullet points
-    3. Content must be extracted from the text
-    4. Use professional business language
-    
-    Format your response EXACTLY like this JSON:
-    {json.dumps(RESPONSE_JSON, indent=2)}
-    Replace the example content with real content from the text.
-    """
-
-    response = ollama.chat(
-        model='llama3.2:3b',
-        messages=[{
-            'role': 'user',
-            'content': PROMPT_TEMPLATE
-        }],
-        format='json',
-        options={
-            'temperature': 0.2,
-            'num_ctx': 2048
-        }
-    )
+RESPONSE_JSON = {
+    "title": "Clear Slide Title",
+    "content": ["Concise point 1", "Relevant point 2", "Key takeaway 3"]
+}
+
+STATIC_INSTRUCTIONS = f"""
+You are creating one slide of a structured PowerPoint presentation.
+Follow these rules:
+1. Slide title should be 3-7 words
+2. The slide should have 3-5 bullet points
+3. Content must be extracted from the text
+4. Use professional business language
+
+Format your response EXACTLY like this JSON:
+{json.dumps(RESPONSE_JSON, indent=2)}
+Replace the example content with real content from the text.
+---
+"""
+
+CHAT_OPTIONS = {
+    'temperature': 0.2,
+    'num_ctx': NUM_CTX
+}
+
+async def _one_slide(client, semaphore, chunk, idx, slide_count, model):
+    """Ask the model for a single slide built from one chunk of the text."""
+    PROMPT_TEMPLATE = STATIC_INSTRUCTIONS + f"""
+Text: {select_text(chunk, MAX_TEXT_CHARS)}
+Slide: {idx + 1} of {slide_count}
+"""
+
+    async with semaphore:
+        reply = await chat(client, PROMPT_TEMPLATE, CHAT_OPTIONS, model)
+    slide = extract_json(reply)
+    if not isinstance(slide, dict) or not isinstance(slide.get("title"), str):
+        raise ValueError("slide is missing a 'title' string")
+    content = slide.get("content")
+    if not isinstance(content, list) or not content or not all(isinstance(point, str) for point in content):
+        raise ValueError("slide 'content' is not a non-empty list of strings")
+    return slide
+
+# Not st.cache_data: on_slide draws into the caller's placeholders, which
+# Streamlit cannot replay on a cache hit. Reuse comes from get_llm_cache().
+def fetch_ppt_content(text_content, slide_count, model=MODEL, on_slide=None):
+    cache = get_llm_cache()
+    key = cache_key(LLM_BACKEND, STATIC_INSTRUCTIONS, MAX_TEXT_CHARS, text_content, slide_count, model)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    chunks = split_text(text_content, slide_count)
+
+    client = get_llm_client()
+    semaphore = get_llm_semaphore()
+    futures = {
+        submit(_one_slide(client, semaphore, chunks[i], i, slide_count, model)): i
+        for i in range(slide_count)
+    }
 
     try:
-        content = json.loads(response['message']['content'])
-        if len(content["slides"]) != slide_count:
-            st.error(f"Requested {slide_count} slides but got {len(content['slides'])}")
-            return None
-        return content["slides"]
+        slides = [None] * slide_count
+        for future in concurrent.futures.as_completed(futures):
+            idx = futures[future]
+            slides[idx] = future.result()
+            if on_slide:
+                on_slide(idx, slides[idx])  # Report each slide as soon as its request finishes
+        cache.set(key, slides, expire=CACHE_TTL)
+        return slides
     except Exception as e:
         st.error(f"Failed to parse response: {str(e)}")
         return None
+    finally:
+        # Also runs on Streamlit's RerunException/StopException (BaseException),
+        # so abandoned requests release their slots in the shared semaphore
+        for future in futures:
+            future.cancel()
 
 def extract_text_from_file(uploaded_file):
     """Extract text from uploaded PDF or text files."""
     if uploaded_file.name.endswith('.pdf'):
-        pdf_reader = PdfReader(uploaded_file)
-        return " ".join(page.extract_text() or "" for page in pdf_reader.pages).strip()
+        return " ".join(read_pdf_pages(uploaded_file.getvalue())).strip()
     elif uploaded_file.name.endswith(('.txt', '.md')):
         return uploaded_file.getvalue().decode("utf-8").strip()
     else:
         st.error("Unsupported file format")
         return None
 
-def create_ppt_from_template(slides_data, template_file):
-    """Generate a PPT using the provided template for design only."""
-    prs = Presentation(template_file)
-    
+def list_style_xml(size_pt, color):
+    """Return <a:lstStyle> markup giving a textbox's paragraphs a default size and color."""
+    return (
+        f'<a:lstStyle {nsdecls("a")}><a:lvl1pPr><a:defRPr sz="{size_pt * 100}">'
+        f'<a:solidFill><a:srgbClr val="{color}"/></a:solidFill>'
+        f'</a:defRPr></a:lvl1pPr></a:lstStyle>'
+    )
+
+def paragraph_xml(text):
+    """Return <a:p> markup for one unstyled paragraph, ready for parse_xml."""
+    return f'<a:p {nsdecls("a")}><a:r><a:t>{escape(text)}</a:t></a:r></a:p>'
+
+def slide_paragraphs(slide_data):
+    """Return (title_xml, [bullet_xml, ...]) for one slide; no presentation state needed."""
+    title_xml = paragraph_xml(sanitize_text(slide_data["title"]))
+    content_xml = [paragraph_xml(sanitize_text(point)) for point in slide_data["content"]]
+    return title_xml, content_xml
+
+def set_list_style(text_body, style_xml):
+    """Swap the textbox's empty <a:lstStyle> for the styled one."""
+    text_body.replace(text_body.find(qn('a:lstStyle')), parse_xml(style_xml))
+
+@st.cache_resource(max_entries=16)
+def load_template_background(template_bytes):
+    """Parse a template once per distinct file and return its background color."""
+    prs = Presentation(io.BytesIO(template_bytes))
+
     # Extract background color if available
     try:
         template_slide = prs.slides[0]
         background_fill = template_slide.background.fill
         background_fill.solid()  # Ensure solid fill before setting color
-        background_color = background_fill.fore_color.rgb
+        return background_fill.fore_color.rgb
     except AttributeError:
-        background_color = None  # If no valid background, skip setting it
+        return None  # If no valid background, skip setting it
+
+def create_ppt_from_template(slides_data, template_file):
+    """Generate a PPT using the provided template for design only."""
+    background_color = load_template_background(template_file.getvalue())
 
     # Create a blank presentation for content
     prs_new = Presentation()
@@ -89,35 +150,33 @@ def create_ppt_from_template(slides_data, template_file):
         if background_color:
             slide_master.background.fill.fore_color.rgb = background_color
 
+    # Dynamically choose text color based on background
+    text_color = RGBColor(255, 255, 255) if background_color and sum(background_color) < 382 else RGBColor(0, 0, 0)
+
+    # Styles are set once per textbox, so paragraphs carry no formatting
+    title_style = list_style_xml(32, text_color)
+    content_style = list_style_xml(20, text_color)
+
+    # Layout and box geometry are the same for every slide
+    slide_layout = prs_new.slide_layouts[5]  # Use Blank layout
+    title_geometry = (Inches(0.5), Inches(0.3), Inches(9), Inches(1))
+    content_geometry = (Inches(1), Inches(1.5), Inches(8), Inches(5))
+
     # Add slides with content
-    for slide_data in slides_data:
-        slide_layout = prs_new.slide_layouts[5]  # Use Blank layout
+    for title_xml, content_xml in map(slide_paragraphs, slides_data):
         slide = prs_new.slides.add_slide(slide_layout)
 
-        # Dynamically choose text color based on background
-        text_color = RGBColor(255, 255, 255) if background_color and sum(background_color) < 382 else RGBColor(0, 0, 0)
-
         # Add title (ensure it exists)
-        title_box = slide.shapes.add_textbox(Inches(0.5), Inches(0.3), Inches(9), Inches(1))
-        title_frame = title_box.text_frame
-        title_frame.text = sanitize_text(slide_data["title"])
-        title_frame.paragraphs[0].font.size = Pt(32)
-        title_frame.paragraphs[0].font.color.rgb = text_color
+        title_body = slide.shapes.add_textbox(*title_geometry).text_frame._txBody
+        set_list_style(title_body, title_style)
+        title_body.remove(title_body.p_lst[0])
+        title_body.append(parse_xml(title_xml))
 
         # Add content
-        left = Inches(1)
-        top = Inches(1.5)
-        width = Inches(8)
-        height = Inches(5)
-        textbox = slide.shapes.add_textbox(left, top, width, height)
-        text_frame = textbox.text_frame
-
-        for point in slide_data["content"]:
-            p = text_frame.add_paragraph()
-            p.text = sanitize_text(point)
-            p.level = 0
-            p.font.size = Pt(20)
-            p.font.color.rgb = text_color  # Ensure text visibility
+        text_body = slide.shapes.add_textbox(*content_geometry).text_frame._txBody
+        set_list_style(text_body, content_style)
+        for point_xml in content_xml:
+            text_body.append(parse_xml(point_xml))
 
     # Save to bytes buffer for Streamlit
     ppt_buffer = io.BytesIO()
@@ -125,14 +184,32 @@ def create_ppt_from_template(slides_data, template_file):
     ppt_buffer.seek(0)
     return ppt_buffer
 
+# C0/C1 control characters, deleted with a single str.translate pass
+_CTRL_TABLE = dict.fromkeys(list(range(0x00, 0x20)) + list(range(0x7F, 0xA0)))
+BULLET_CHARS = '\u2022\u2023\u25aa\u25cf\u25e6\u2043-* '
+
 def sanitize_text(text):
     """Clean up model-generated text."""
-    text = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', text)  # Remove control characters
-    text = text.strip('•-* ')  # Remove leading/trailing bullets
+    text = text.translate(_CTRL_TABLE)  # Remove control characters
+    text = text.strip(BULLET_CHARS)  # Remove leading/trailing bullets
     return text[:500]  # Limit text length
 
+def show_slide_preview(placeholder, slide):
+    bullets = "\n".join(f"- {sanitize_text(point)}" for point in slide["content"])
+    placeholder.markdown(f"**{sanitize_text(slide['title'])}**\n\n{bullets}")
+
+def show_download_button(ppt_bytes):
+    st.download_button(
+        label="Download PowerPoint",
+        data=ppt_bytes,
+        file_name="generated_presentation.pptx",
+        mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
+    )
+
 def main():
     st.title("Professional PPT Generator")
+    model = select_model()
+    warm_prompt_cache(STATIC_INSTRUCTIONS, CHAT_OPTIONS, model)
 
     # File upload section
     col1, col2 = st.columns(2)
@@ -144,31 +221,45 @@ def main():
     # Configuration
     slide_count = st.number_input("Number of slides to generate", min_value=1, max_value=20, value=5)
 
+    # Everything that affects the generated deck; unchanged means reuse the last one
+    fingerprint = (
+        uploaded_file and (uploaded_file.name, uploaded_file.size),
+        template_file and (template_file.name, template_file.size),
+        slide_count,
+        model,
+    )
+
     if st.button("Generate Presentation") and uploaded_file and template_file:
         with st.spinner("Analyzing document and generating slides..."):
             # Extract text
             text_content = extract_text_from_file(uploaded_file)
             
             if text_content:
-                # Generate slide content
-                slides_data = fetch_ppt_content(text_content, slide_count)
+                # Generate slide content, previewing slides as they arrive
+                previews = [st.empty() for _ in range(slide_count)]
+                slides_data = fetch_ppt_content(
+                    text_content, slide_count, model,
+                    on_slide=lambda idx, slide: show_slide_preview(previews[idx], slide)
+                )
                 
                 if slides_data:
+                    # Disk cache hits return without calling on_slide, so fill in the previews
+                    for placeholder, slide in zip(previews, slides_data):
+                        show_slide_preview(placeholder, slide)
+
                     # Create PPT from template
                     try:
                         ppt_buffer = create_ppt_from_template(slides_data, template_file)
                         if ppt_buffer:
+                            st.session_state.ppt_buffer = ppt_buffer.getvalue()
+                            st.session_state.ppt_fingerprint = fingerprint
                             st.success("Presentation created successfully!")
-                            
-                            # Download button
-                            st.download_button(
-                                label="Download PowerPoint",
-                                data=ppt_buffer,
-                                file_name="generated_presentation.pptx",
-                                mime="application/vnd.openxmlformats-officedocument.presentationml.presentation"
-                            )
+                            show_download_button(st.session_state.ppt_buffer)
                     except Exception as e:
                         st.error(f"PPT creation failed: {str(e)}")
+    elif st.session_state.get('ppt_buffer') and st.session_state.get('ppt_fingerprint') == fingerprint:
+        # Plain reruns (e.g. clicking Download) keep the last deck instead of losing it
+        show_download_button(st.session_state.ppt_buffer)
 
 if __name__ == "__main__":
     main()
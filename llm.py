@@ -0,0 +1,259 @@
+import streamlit as st
+import asyncio
+import hashlib
+import httpx
+import io
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+import ollama
+from PyPDF2 import PdfReader
+
+try:
+    from json_repair import repair_json
+except ImportError:
+    repair_json = None
+
+try:
+    import diskcache
+except ImportError:
+    diskcache = None
+
+try:
+    import pypdfium2 as pdfium
+except ImportError:
+    pdfium = None
+
+logger = logging.getLogger(__name__)
+
+# A small quantized model is plenty for short JSON extraction and roughly
+# doubles tokens/sec over llama3.2:3b; override with QUIZ_MODEL
+MODEL = os.getenv('QUIZ_MODEL', 'llama3.2:1b-instruct-q4_0')
+MODEL_CHOICES = ['llama3.2:1b-instruct-q4_0', 'llama3.2:3b-instruct-q4_K_M', 'llama3.2:3b']
+
+# 'ollama' (default) or 'llamacpp' for a llama-server OpenAI-compatible endpoint
+LLM_BACKEND = os.getenv('LLM_BACKEND', 'ollama')
+LLAMACPP_HOST = os.getenv('LLAMACPP_HOST', 'http://localhost:8080')
+# Sent with every Ollama request so the model stays loaded between users
+OLLAMA_KEEP_ALIVE = os.getenv('OLLAMA_KEEP_ALIVE', '30m')
+# Upper bound on in-flight requests; match the server's OLLAMA_NUM_PARALLEL
+OLLAMA_NUM_PARALLEL = int(os.getenv('OLLAMA_NUM_PARALLEL', '4'))
+
+# Generated content survives server restarts for a day
+CACHE_DIR = '.llm_cache'
+CACHE_TTL = 86400
+
+# Text budget per prompt; keeps prefill cost bounded by num_ctx. Every app must
+# send NUM_CTX unchanged (only sampling options like temperature may differ),
+# because a different num_ctx makes Ollama reload the model.
+MAX_TEXT_CHARS = 4000
+PROMPT_OVERHEAD_CHARS = 1000  # Static instructions, schema and per-item header lines
+
+def extract_json(raw):
+    """Parse the outermost {...} block of a free-form model reply."""
+    logger.debug("Raw model output: %s", raw)
+    match = re.search(r'\{.*\}', raw, re.S)
+    candidate = match.group(0) if match else raw
+    try:
+        parsed = json.loads(candidate)
+    except json.JSONDecodeError:
+        if repair_json is None:
+            raise
+        parsed = json.loads(repair_json(candidate))
+    logger.debug("Parsed model output: %s", parsed)
+    return parsed
+
+class MemoryCache:
+    """In-process stand-in for diskcache.Cache (get/set with expire) when it is not installed."""
+
+    def __init__(self, max_entries=64):
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+        self._max_entries = max_entries
+
+    def get(self, key):
+        with self._lock:
+            value, expires_at = self._items.get(key, (None, None))
+            if expires_at is not None and expires_at < time.monotonic():
+                del self._items[key]
+                return None
+            return value
+
+    def set(self, key, value, expire=None):
+        with self._lock:
+            self._items[key] = (value, time.monotonic() + expire if expire else None)
+            self._items.move_to_end(key)
+            while len(self._items) > self._max_entries:
+                self._items.popitem(last=False)
+
+@st.cache_resource
+def get_llm_cache():
+    """Open the response cache once per server process: on disk if possible, else in memory."""
+    return diskcache.Cache(CACHE_DIR) if diskcache else MemoryCache()
+
+def cache_key(*parts):
+    """Stable key for a prompt's inputs."""
+    return hashlib.sha256("\x1f".join(str(p) for p in parts).encode()).hexdigest()
+
+def split_text(text_content, parts):
+    """Split text into roughly equal chunks, one per generated item."""
+    size = max(1, -(-len(text_content) // parts))
+    chunks = [text_content[i:i + size] for i in range(0, len(text_content), size)]
+    return (chunks + [text_content] * parts)[:parts]
+
+def select_text(text_content, max_chars):
+    """Keep the first max_chars of the text, cut back to a word boundary."""
+    if len(text_content) <= max_chars:
+        return text_content
+    cut = text_content.rfind(" ", 0, max_chars)
+    return text_content[:cut if cut > 0 else max_chars]
+
+def context_size(prompt_chars, reply_tokens=512):
+    """Smallest num_ctx (in steps of 256) that fits the prompt and the reply."""
+    prompt_tokens = -(-prompt_chars // 4)  # ~4 characters per token
+    return -(-(prompt_tokens + reply_tokens) // 256) * 256
+
+NUM_CTX = context_size(PROMPT_OVERHEAD_CHARS + MAX_TEXT_CHARS)
+
+@st.cache_resource
+def get_event_loop():
+    """Background event loop shared by every session, so clients can be reused."""
+    loop = asyncio.new_event_loop()
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return loop
+
+def submit(coro):
+    """Schedule a coroutine on the shared loop and return a concurrent Future."""
+    return asyncio.run_coroutine_threadsafe(coro, get_event_loop())
+
+@st.cache_resource
+def get_llm_client():
+    """One pooled HTTP client per server process, kept alive across reruns."""
+    # Keep one connection per parallel slot open so concurrent requests never
+    # wait on a TCP handshake; both servers speak HTTP/1.1 only, so no http2.
+    limits = httpx.Limits(
+        max_connections=OLLAMA_NUM_PARALLEL,
+        max_keepalive_connections=OLLAMA_NUM_PARALLEL
+    )
+    if LLM_BACKEND == 'llamacpp':
+        return httpx.AsyncClient(base_url=LLAMACPP_HOST, timeout=None, limits=limits)
+    return ollama.AsyncClient(host=os.getenv('OLLAMA_HOST', 'http://localhost:11434'), limits=limits)
+
+async def _new_semaphore():
+    return asyncio.Semaphore(OLLAMA_NUM_PARALLEL)
+
+@st.cache_resource
+def get_llm_semaphore():
+    """Caps in-flight requests across all sessions at OLLAMA_NUM_PARALLEL."""
+    return submit(_new_semaphore()).result()
+
+async def chat(client, prompt, options, model=MODEL, num_predict=None):
+    """Send one user prompt to the configured backend and return the reply text."""
+    if LLM_BACKEND == 'llamacpp':
+        payload = {
+            'model': model,
+            'messages': [{'role': 'user', 'content': prompt}],
+            'temperature': options['temperature'],
+            'cache_prompt': True,
+        }
+        if num_predict is not None:
+            payload['max_tokens'] = num_predict
+        response = await client.post('/v1/chat/completions', json=payload)
+        response.raise_for_status()
+        return response.json()['choices'][0]['message']['content']
+
+    if num_predict is not None:
+        options = {**options, 'num_predict': num_predict}
+    response = await client.chat(
+        model=model,
+        messages=[{
+            'role': 'user',
+            'content': prompt
+        }],
+        options=options,
+        keep_alive=OLLAMA_KEEP_ALIVE
+    )
+    return response['message']['content']
+
+@st.cache_resource
+def get_warmup_futures():
+    """In-flight or finished warm-up requests, keyed by (prefix, model)."""
+    return {}
+
+_WARMUP_LOCK = threading.Lock()
+
+def warm_prompt_cache(prefix, options, model=MODEL):
+    """Load the model and send the static prefix once so later requests start warm.
+
+    Apps build each prompt as a parameter-free prefix (instructions and JSON
+    schema) followed by the document text and per-item settings, so every
+    request shares the prefix and Ollama can reuse its KV cache.
+
+    Never blocks the script and never raises. The request runs on the shared
+    loop, and a new one is sent only after the previous one failed (e.g. the
+    app started before the server), so a slow cold load is not re-queued on
+    every rerun.
+    """
+    key = (prefix, model)
+    with _WARMUP_LOCK:
+        futures = get_warmup_futures()
+        future = futures.get(key)
+        if future is not None and not (future.done() and (future.cancelled() or future.exception())):
+            return
+        if future is not None:
+            logger.debug("Warm-up for %s failed, retrying", model)
+        futures[key] = submit(chat(get_llm_client(), prefix, options, model, num_predict=1))
+
+def iter_pdf_pages(uploaded_file):
+    """Yield (index, page_count, text) for each PDF page, using PDFium when installed."""
+    if pdfium is None:
+        pages = PdfReader(uploaded_file).pages
+        for i, page in enumerate(pages):
+            yield i, len(pages), page.extract_text() or ""  # Handle pages with no text
+        return
+
+    pdf = pdfium.PdfDocument(uploaded_file.getvalue())
+    try:
+        total_pages = len(pdf)
+        for i in range(total_pages):
+            page = pdf[i]
+            textpage = page.get_textpage()
+            yield i, total_pages, textpage.get_text_range()
+            textpage.close()
+            page.close()
+    finally:
+        pdf.close()
+
+@st.cache_resource
+def get_page_cache():
+    """Extracted PDF pages keyed by file digest, shared by every session."""
+    return MemoryCache(max_entries=16)
+
+def read_pdf_pages(file_bytes, progress_callback=None):
+    """Text of every PDF page; progress is reported per page only when the file is parsed.
+
+    Deliberately not st.cache_data: the callback drives the caller's widgets,
+    which Streamlit cannot replay on a cache hit.
+    """
+    cache = get_page_cache()
+    key = hashlib.sha256(file_bytes).hexdigest()
+    pages = cache.get(key)
+    if pages is None:
+        pages = []
+        for i, total_pages, page_text in iter_pdf_pages(io.BytesIO(file_bytes)):
+            pages.append(page_text)
+            if progress_callback:
+                progress_callback((i + 1) / total_pages)
+        cache.set(key, pages)
+    return pages
+
+def select_model():
+    """Sidebar model picker; llama.cpp serves whichever GGUF it was started with."""
+    if LLM_BACKEND == 'llamacpp':
+        return MODEL
+    choices = MODEL_CHOICES if MODEL in MODEL_CHOICES else [MODEL] + MODEL_CHOICES
+    return st.sidebar.selectbox("Model", choices, index=choices.index(MODEL))
@@ -1,71 +1,99 @@
 import streamlit as st
 import json
-import ollama
-from PyPDF2 import PdfReader
-
-@st.cache_data
-def fetch_questions(text_content, quiz_level):
-    RESPONSE_JSON = {
-      "mcqs" : [
-        {
-            "mcq": "multiple choice question1",
-            "options": {
-                "a": "choice here1",
-                "b": "choice here2",
-                "c": "choice here3",
-                "d": "choice here4",
-            },
-            "correct": "correct choice option in the form of a, b, c or d",
-        }
-      ]
-    }
-
-    PROMPT_TEMPLATE = f"""
-    Text: {text_content}
-    You are an expert in generating MCQ type quiz on the basis of provided content. 
-    Create a quiz of 2 multiple choice questions with difficulty level: {quiz_level}. 
-    Ensure questions are unique and relevant to the text.
-    Format your response exactly like this JSON structure:
-    {json.dumps(RESPONSE_JSON, indent=2)}
-    """
-
-    response = ollama.chat(
-        model='llama3.2:3b',
-        messages=[{
-            'role': 'user',
-            'content': PROMPT_TEMPLATE
-        }],
-        format='json',
-        options={
-            'temperature': 0.3,
-            'num_ctx': 1024
-        }
-    )
+from llm import (
+    CACHE_TTL, LLM_BACKEND, MAX_TEXT_CHARS, MODEL, NUM_CTX, cache_key, chat, extract_json,
+    get_llm_cache, get_llm_client, get_llm_semaphore, read_pdf_pages,
+    select_model, select_text, split_text, submit, warm_prompt_cache,
+)
+
+QUESTION_COUNT = 2
+
+RESPONSE_JSON = {
+    "mcq": "multiple choice question",
+    "options": {
+        "a": "choice here1",
+        "b": "choice here2",
+        "c": "choice here3",
+        "d": "choice here4",
+    },
+    "correct": "correct choice option in the form of a, b, c or d",
+}
+
+STATIC_INSTRUCTIONS = f"""
+You are an expert in generating MCQ type quiz on the basis of provided content.
+Create one multiple choice question about the text below.
+Ensure the question is unique and relevant to the text.
+Format your response exactly like this JSON structure:
+{json.dumps(RESPONSE_JSON, indent=2)}
+---
+"""
+
+CHAT_OPTIONS = {
+    'temperature': 0.3,
+    'num_ctx': NUM_CTX
+}
+
+async def _one_question(client, semaphore, chunk, quiz_level, idx, model):
+    """Ask the model for a single MCQ built from one chunk of the text."""
+    PROMPT_TEMPLATE = STATIC_INSTRUCTIONS + f"""
+Text: {select_text(chunk, MAX_TEXT_CHARS)}
+Question: {idx + 1} of {QUESTION_COUNT}
+Difficulty level: {quiz_level}
+"""
+
+    async with semaphore:
+        reply = await chat(client, PROMPT_TEMPLATE, CHAT_OPTIONS, model)
+    question = extract_json(reply)
+    if not isinstance(question, dict) or "mcq" not in question:
+        raise ValueError("question is missing 'mcq'")
+    if not isinstance(question.get("options"), dict) or question.get("correct") not in question["options"]:
+        raise ValueError("question 'correct' is not one of its 'options'")
+    return question
+
+# Not st.cache_data: a failed generation would be cached as [] for an hour.
+# Reuse comes from get_llm_cache(), which only stores successful quizzes.
+def fetch_questions(text_content, quiz_level, model=MODEL):
+    cache = get_llm_cache()
+    key = cache_key(LLM_BACKEND, STATIC_INSTRUCTIONS, MAX_TEXT_CHARS, text_content, quiz_level, QUESTION_COUNT, model)
+    cached = cache.get(key)
+    if cached is not None:
+        return cached
+
+    # Requests cannot see each other, so each question gets its own part of the
+    # document; otherwise identical prompts tend to produce duplicate questions
+    chunks = split_text(text_content, QUESTION_COUNT)
+
+    client = get_llm_client()
+    semaphore = get_llm_semaphore()
+    futures = [
+        submit(_one_question(client, semaphore, chunks[i], quiz_level, i, model))
+        for i in range(QUESTION_COUNT)
+    ]
 
     try:
-        return json.loads(response['message']['content']).get("mcqs", [])
-    except json.JSONDecodeError:
-        st.error("Failed to parse response from Ollama. Please try again.")
+        questions = [future.result() for future in futures]
+        cache.set(key, questions, expire=CACHE_TTL)
+        return questions
+    except Exception as e:
+        st.error(f"Failed to parse response from Ollama: {str(e)}. Please try again.")
         return []
+    finally:
+        # Also runs on Streamlit's RerunException/StopException (BaseException),
+        # so abandoned requests release their slots in the shared semaphore
+        for future in futures:
+            future.cancel()
 
 def extract_text_from_file(uploaded_file, progress_callback=None):
     if uploaded_file.name.endswith('.pdf'):
-        pdf_reader = PdfReader(uploaded_file)
-        total_pages = len(pdf_reader.pages)
-        text = ""
-        for i, page in enumerate(pdf_reader.pages):
-            text += page.extract_text() or ""  # Handle pages with no text
-            if progress_callback:
-                progress = (i + 1) / total_pages
-                progress_callback(progress)
-        return text.strip()
+        text = "".join(read_pdf_pages(uploaded_file.getvalue(), progress_callback)).strip()
     elif uploaded_file.name.endswith(('.txt', '.md')):
-        if progress_callback:
-            progress_callback(1.0)  # Instant completion for text files
-        return uploaded_file.getvalue().decode("utf-8")
+        text = uploaded_file.getvalue().decode("utf-8")
     else:
         st.error("Unsupported file format")
         return None
+    if progress_callback:
+        progress_callback(1.0)  # Cached PDFs and text files finish instantly
+    return text
 
 # ... (keep previous imports and functions unchanged)
 
@@ -73,6 +101,8 @@ def extract_text_from_file(uploaded_file, progress_callback=None):
 
 def main():
     st.title("Quiz generator")
+    model = select_model()
+    warm_prompt_cache(STATIC_INSTRUCTIONS, CHAT_OPTIONS, model)
 
     # Initialize session state variables
     if 'processed_text' not in st.session_state:
@@ -108,11 +138,13 @@ def main():
                     # Generate quiz if text processing succeeded
                     if processed_text:
                         quiz_level = st.session_state.get('quiz_level', 'easy')
-                        questions = fetch_questions(processed_text, quiz_level)
+                        questions = fetch_questions(processed_text, quiz_level, model)
                         st.session_state.questions = questions
                         st.session_state.quiz_generated = True
                         st.session_state.selected_options = [None] * len(questions)
-                        st.session_state.correct_answers = []
+                        st.session_state.correct_answers = [
+                            q["options"][q["correct"]] for q in questions
+                        ]
                     
                     progress_bar.empty()
 
@@ -130,12 +162,6 @@ def main():
         if st.session_state.quiz_generated and 'questions' in st.session_state:
             questions = st.session_state.questions
             if questions:
-                # Initialize answer tracking
-                if not st.session_state.correct_answers:
-                    st.session_state.correct_answers = [
-                        q["options"][q["correct"]] for q in questions
-                    ]
-
                 # Display questions with proper index handling
                 for i, question in enumerate(questions):
                     options = list(question["options"].values())
@@ -158,12 +184,14 @@ def main():
 
                 # Submit button
                 if st.button("Submit"):
-                    marks = sum(1 for sel, cor in zip(st.session_state.selected_options, st.session_state.correct_answers) if sel == cor)
                     st.header("Quiz Result:")
-                    for i, question in enumerate(questions):
+                    marks = 0
+                    # Score and render in a single pass over the questions
+                    for question, selected, correct in zip(questions, st.session_state.selected_options, st.session_state.correct_answers):
+                        marks += selected == correct
                         st.subheader(f"{question['mcq']}")
-                        st.write(f"You selected: {st.session_state.selected_options[i]}")
-                        st.write(f"Correct answer: {st.session_state.correct_answers[i]}")
+                        st.write(f"You selected: {selected}")
+                        st.write(f"Correct answer: {correct}")
                     st.subheader(f"You scored {marks} out of {len(questions)}")
                     
                     # Reset session state